@@ -1,16 +1,21 @@
 #!/usr/bin/env python
 import argparse
+import base64
+import datetime
+import io
 import jinja2
 import json
 import logging
 import os
 import re
+import struct
 import sys
 import traceback
 try:
     import xml.etree.cElementTree as ET
 except ImportError:
     import xml.etree.ElementTree as ET
+from collections import OrderedDict
 from operator import itemgetter
 
 '''
@@ -33,30 +38,152 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 logger = logging.getLogger()
 
-runparam_xpath = {
-    'runid':'RunID',
-    'rundate':'RunStartDate',
-    'basespaceid':'BaseSpaceRunId',
-    'runnumber':'RunNumber',
-    'read1':'.//Setup/Read1',
-    'read2':'.//Setup/Read2',
-    'index1':'.//Setup/Index1Read',
-    'index2':'.//Setup/Index2Read',
-    'libid':'LibraryID',
-    'experiment':'ExperimentName'
-    }
+run_header = ["Date","RunID","RunNumber","Read1","Read2","Index1Read","Index2Read","BaseSpaceRunId","ExperimentName",
+              "LibraryID","ClusterDensity","ClustersPassingFilter","EstimatedYield","CompletionStatus","CompletionTime"]
+# column types for field conversion and the html data encoding: s: string, i: int, f: float
+run_coltypes = ['s','s','i','i','i','i','i','s','s','s','f','f','f','s','s']
+# CompletionTime format, RunStartDate format
+time_format = '%Y-%m-%d %H:%M:%S'
+rundate_format = '%y%m%d'
 
-runcompletion_xpath = {
-    'cd':'ClusterDensity',
-    'cpf':'ClustersPassingFilter',
-    'ey':'EstimatedYield',
-    'status':'CompletionStatus'
+# RunCompletionStatus.xml fields, shared by all variants
+completion_fields = {
+    'ClusterDensity':('RunCompletionStatus.xml','ClusterDensity'),
+    'ClustersPassingFilter':('RunCompletionStatus.xml','ClustersPassingFilter'),
+    'EstimatedYield':('RunCompletionStatus.xml','EstimatedYield'),
+    'CompletionStatus':('RunCompletionStatus.xml','CompletionStatus'),
+    'CompletionTime':('RunCompletionStatus.xml',None)
     }
 
-def plot_d3(all_runs):
+# RunParameters.xml layouts, the first variant with its 'detect' path in RunParameters.xml is used
+# fields: column -> (xml file, path[, attribute[, conversion]]), conversion defaults to the column type,
+# a path of None gives the file modification time.
+# Columns missing in a variant are set to None for strings and 0 for numbers,
+# except for required_columns: run folders without them are skipped
+run_variants = OrderedDict([
+    ('nextseq500', {
+        'detect':'.//Setup/Read1',
+        'fields':dict(completion_fields,**{
+            'Date':('RunParameters.xml','RunStartDate'),
+            'RunID':('RunParameters.xml','RunID'),
+            'RunNumber':('RunParameters.xml','RunNumber'),
+            'Read1':('RunParameters.xml','.//Setup/Read1'),
+            'Read2':('RunParameters.xml','.//Setup/Read2'),
+            'Index1Read':('RunParameters.xml','.//Setup/Index1Read'),
+            'Index2Read':('RunParameters.xml','.//Setup/Index2Read'),
+            'BaseSpaceRunId':('RunParameters.xml','BaseSpaceRunId'),
+            'ExperimentName':('RunParameters.xml','ExperimentName'),
+            'LibraryID':('RunParameters.xml','LibraryID')
+            })
+        }),
+    ('nextseq2000', {
+        'detect':'.//PlannedReads',
+        'fields':dict(completion_fields,**{
+            'Date':('RunParameters.xml','RunId',None,'runid_date'),
+            'RunID':('RunParameters.xml','RunId'),
+            'RunNumber':('RunParameters.xml','RunCounter'),
+            'Read1':('RunParameters.xml',".//PlannedReads/Read[@ReadName='Read1']",'Cycles'),
+            'Read2':('RunParameters.xml',".//PlannedReads/Read[@ReadName='Read2']",'Cycles'),
+            'Index1Read':('RunParameters.xml',".//PlannedReads/Read[@ReadName='Index1']",'Cycles'),
+            'Index2Read':('RunParameters.xml',".//PlannedReads/Read[@ReadName='Index2']",'Cycles'),
+            'ExperimentName':('RunParameters.xml','ExperimentName')
+            })
+        }),
+    ('novaseq', {
+        'detect':'Read1NumberOfCycles',
+        'fields':dict(completion_fields,**{
+            'Date':('RunParameters.xml','RunStartDate'),
+            'RunID':('RunParameters.xml','RunId'),
+            'RunNumber':('RunParameters.xml','RunNumber'),
+            'Read1':('RunParameters.xml','Read1NumberOfCycles'),
+            'Read2':('RunParameters.xml','Read2NumberOfCycles'),
+            'Index1Read':('RunParameters.xml','IndexRead1NumberOfCycles'),
+            'Index2Read':('RunParameters.xml','IndexRead2NumberOfCycles'),
+            'ExperimentName':('RunParameters.xml','ExperimentName'),
+            'LibraryID':('RunParameters.xml','RfidsInfo/LibraryTubeSerialBarcode')
+            })
+        })
+    ])
+
+# runs taking longer than this (start date to RunCompletionStatus.xml mtime) are left out of instrument and idle hours
+max_run_hours = 72
+
+required_columns = ['Date','RunID','CompletionTime']
+
+usage_header = ["Month","Instrument","Runs","EstimatedYield","Cycles","InstrumentHours","IdleHours"]
+
+# default d3 bundle for --offline, expected next to this script
+d3_bundle = os.path.join(os.path.dirname(os.path.abspath(__file__)),'d3.v4.min.js')
+
+# above this many runs, the html report draws bars and dots on a canvas instead of svg nodes
+canvas_threshold = 1000
+
+# typed array codes for pack_runs: struct format and javascript array
+pack_formats = {'u1':'B','u2':'H','i4':'i','f4':'f'}
+
+def pack_width(maxval):
+    '''
+    Narrowest unsigned typed array code for values in 0..maxval
+    '''
+    if maxval<2**8:
+        return 'u1'
+    elif maxval<2**16:
+        return 'u2'
+    return 'i4'
+
+def pack_array(code,vals):
+    return base64.b64encode(struct.pack('<{}{}'.format(len(vals),pack_formats[code]),*vals)).decode('ascii')
+
+def pack_runs(all_runs):
+    '''
+    Column wise compact encoding of run data for the html plots:
+    int columns are packed as base64 little endian typed arrays of the narrowest width, float columns as float32,
+    string columns with mostly repeated values (e.g. CompletionStatus) are dictionary encoded with
+    typed array indices, other string columns are kept as plain lists
+    '''
+    cols = list()
+    for ci,ctype in enumerate(run_coltypes):
+        coldat = [rdat[ci] for rdat in all_runs]
+        if ctype=='s':
+            coldat = [cv.decode('ascii') if isinstance(cv,bytes) else cv for cv in coldat]
+            vals = list()
+            lookup = dict()
+            idx = list()
+            for cv in coldat:
+                if cv not in lookup:
+                    lookup[cv] = len(vals)
+                    vals.append(cv)
+                idx.append(lookup[cv])
+            if len(vals)*2>len(coldat):
+                cols.append({'t':'s','v':coldat})
+            else:
+                width = pack_width(len(vals)-1)
+                cols.append({'t':'d','w':width,'v':vals,'d':pack_array(width,idx)})
+        elif ctype=='i':
+            width = pack_width(max(coldat)) if coldat and min(coldat)>=0 else 'i4'
+            cols.append({'t':width,'d':pack_array(width,coldat)})
+        else:
+            cols.append({'t':'f4','d':pack_array('f4',coldat)})
+    return {'n':len(all_runs),'cols':cols}
+
+def plot_d3(all_runs,render_mode='auto',d3js=None,usage=None):
     '''
     Return html plots
+    render_mode: 'svg', 'canvas' or 'auto' (canvas if there are more than canvas_threshold runs)
+    d3js: local d3 bundle to inline, for reports viewed without internet access
+    usage: output of run_usage, computed from all_runs if not given
     '''
+    if usage is None:
+        usage = run_usage(all_runs)
+    d3_inline = None
+    if d3js is not None:
+        if not os.path.isfile(d3js):
+            raise RuntimeError('Cannot find d3 bundle {}, download it from https://d3js.org/d3.v4.min.js'.format(d3js))
+        with io.open(d3js,encoding='utf-8') as d3h:
+            d3_inline = d3h.read().replace('</script','<\\/script')
+    if render_mode=='auto':
+        render_mode = 'canvas' if len(all_runs)>canvas_threshold else 'svg'
+    logging.debug('Html render mode: {}'.format(render_mode))
     html_template = jinja2.Template('''
     <!DOCTYPE html>
 <html>
@@ -77,12 +204,17 @@ def plot_d3(all_runs):
         You should have received a copy of the GNU General Public License
         along with this program.  If not, see <http://www.gnu.org/licenses/>
        -->
+{% if d3_inline %}
+      <script type="text/javascript" charset="utf-8">{{d3_inline}}</script>
+{% else %}
       <script type="text/javascript" src="https://d3js.org/d3.v4.js" charset="utf-8"></script>
       <link href='https://fonts.googleapis.com/css?family=Open+Sans' rel='stylesheet' type='text/css'>
+{% endif %}
         <title>NextSeq 500 run stats</title>
         <style type="text/css">
             head, body {font-family: 'Open Sans', sans-serif;}
             .plotDiv{float: left;}
+            #plotElem{position: relative;}
             #inputf3Label, #inputf5Label{
                 color: #cccccc;
             }
@@ -149,6 +281,10 @@ def plot_d3(all_runs):
                     <option name="inputOpts" value="cd">Avg. Cluster density</option>
                     <option name="inputOpts" value="cpf">Avg. Clusters passing filter</option>
                     <option name="inputOpts" value="ey">Avg. Estimated yield</option>
+                    <option name="inputOpts" value="uyield">Total Estimated yield</option>
+                    <option name="inputOpts" value="ucycles">Cycles run</option>
+                    <option name="inputOpts" value="uhours">Instrument hours</option>
+                    <option name="inputOpts" value="uidle">Idle hours</option>
                 </select>            
             </div>
             <div d="plotOpt2">
@@ -212,8 +348,51 @@ def plot_d3(all_runs):
             <div id="error1"></div>
         </div>
         <script id="data1" type="text/javascript">
-        // column names: Date    RunID RunNumber    Read1    Read2    Index1Read    Index2Read    BaseSpaceRunId    ExperimentName    LibraryID    ClusterDensity    ClustersPassingFilter    EstimatedYield    CompletionStatus
-            var rundat = {{all_dat_json}};
+        // column names: Date    RunID RunNumber    Read1    Read2    Index1Read    Index2Read    BaseSpaceRunId    ExperimentName    LibraryID    ClusterDensity    ClustersPassingFilter    EstimatedYield    CompletionStatus    CompletionTime
+//            run data is packed column wise (see pack_runs), decode it once into rows
+            function b64Typed(b64,Type) {
+                var bin = atob(b64);
+                var bytes = new Uint8Array(bin.length);
+                for (var i=0;i<bin.length;i++) {
+                    bytes[i] = bin.charCodeAt(i);
+                }
+                return new Type(bytes.buffer);
+            }
+            var packTypes = {'u1':Uint8Array,'u2':Uint16Array,'i4':Int32Array,'f4':Float32Array};
+            function unpackRuns(packed) {
+                var cols = packed.cols.map(function(c) {
+                    if (c.t=='s') {return c.v;}
+                    else if (c.t=='f4') {
+//                        float32 back to the (at most 7 significant digits) values written
+                        var fv = b64Typed(c.d,Float32Array);
+                        var vals = new Array(fv.length);
+                        for (var i=0;i<fv.length;i++) {
+                            vals[i] = parseFloat(fv[i].toPrecision(7));
+                        }
+                        return vals;
+                    }
+                    else if (c.t!='d') {return b64Typed(c.d,packTypes[c.t]);}
+                    var idx = b64Typed(c.d,packTypes[c.w]);
+                    var vals = new Array(idx.length);
+                    for (var i=0;i<idx.length;i++) {
+                        vals[i] = c.v[idx[i]];
+                    }
+                    return vals;
+                });
+                var rows = new Array(packed.n);
+                for (var i=0;i<packed.n;i++) {
+                    var row = new Array(cols.length);
+                    for (var j=0;j<cols.length;j++) {
+                        row[j] = cols[j][i];
+                    }
+                    rows[i] = row;
+                }
+                return rows;
+            }
+            var rundat = unpackRuns({{run_pack_json}});
+        // column names: Month    Instrument    Runs    EstimatedYield    Cycles    InstrumentHours    IdleHours
+            var usagedat = {{usage_json}};
+            var renderMode = "{{render_mode}}";
         </script>
         <script id="functions1" type="text/javascript" >
     
@@ -221,106 +400,177 @@ def plot_d3(all_runs):
 //            source: https://stackoverflow.com/questions/29544371/finding-the-average-of-an-array-using-js
 //
             const average = arr => arr.reduce((sume, el) => sume + el, 0) / arr.length;
+//
+//            per month value for the bar plots
+//
+            function barValue (d,plotSelector) {
+                if (plotSelector=='count') {return d.ey.length;}
+                else if (plotSelector=='cd') {return average(d.cd);}
+                else if (plotSelector=='cpf') {return average(d.cpf);}
+                else if (plotSelector=='ey') {return average(d.ey);}
+                else if (d.date in usagemap) {return usagemap[d.date][plotSelector];}
+                return 0;
+            }
+//
+//            tooltip helpers
+//
+            function showTooltip(text) {
+                tooltip.transition().duration(200).style("opacity", .9);
+                tooltip.html(text).style("left", (d3.event.pageX-28) + "px").style("top", (d3.event.pageY-28) + "px");
+            }
+            function hideTooltip() {
+                tooltip.transition().duration(500).style("opacity", 0);
+            }
+//
+//            axes and labels are created once, and only updated here
+//
+            function drawFrame(xAxis,yAxis,rotateX,title,xLabel,yLabel) {
+                gX.call(xAxis);
+                if (rotateX) {
+                    gX.selectAll("text")
+                        .attr("y", 0)
+                        .attr("x", 9)
+                        .attr("dy", ".35em")
+                        .attr("transform", "rotate(90)")
+                        .style("text-anchor", "start");
+                }else {
+                    gX.selectAll("text")
+                        .attr("y", 9)
+                        .attr("x", null)
+                        .attr("dy", ".71em")
+                        .attr("transform", null)
+                        .style("text-anchor", null);
+                }
+                gY.call(yAxis);
+                titleText.text(title);
+                xLabelText.text(xLabel);
+                yLabelText.text(yLabel);
+            }
+//
+//            bar plotter, existing bars are updated instead of re-created
+//            bars: array of {key, value, label}
+//
+            function drawBars(bars,xScale,yScale,barClass) {
+                gDots.selectAll("circle").remove();
+                if (renderMode=='canvas') {
+                    canvasMarks = {'type':'bar','items':bars,'xScale':xScale,'yScale':yScale,'fill':barFill[barClass],'tree':null,'active':-1};
+                    canvasDraw();
+                    return;
+                }
+                var rects = gBars.selectAll("rect").data(bars, function(d) {return d.key; });
+                rects.exit().remove();
+                rects.enter().append("rect")
+                    .on("mouseover", function(d) {showTooltip(d.label); })
+                    .on("mouseout", hideTooltip)
+                  .merge(rects)
+                    .attr("class", barClass)
+                    .attr("x", function(d) {return xScale(d.key); })
+                    .attr("width", xScale.bandwidth())
+                    .attr("y", function(d) {return yScale(d.value); })
+                    .attr("height", function(d) {return height-yScale(d.value); });
+            }
+//
+//            canvas renderer, used for large data sets
+//
+            function canvasDraw() {
+                var cm = canvasMarks;
+                ctx.clearRect(0, 0, width, height);
+                if (cm.type=='bar') {
+                    var bw = cm.xScale.bandwidth();
+                    for (var i=0;i<cm.items.length;i++) {
+                        var y = cm.yScale(cm.items[i].value);
+                        ctx.fillStyle = (i==cm.active) ? cm.fill[1] : cm.fill[0];
+                        ctx.fillRect(cm.xScale(cm.items[i].key), y, bw, height-y);
+                    }
+                }else if (cm.type=='dot') {
+//                    all dots in a single path
+                    ctx.fillStyle = dotFill;
+                    ctx.beginPath();
+                    for (var i=0;i<cm.items.length;i++) {
+                        if (i==cm.active) {continue;}
+                        ctx.moveTo(cm.items[i].px+5, cm.items[i].py);
+                        ctx.arc(cm.items[i].px, cm.items[i].py, 5, 0, 2*Math.PI);
+                    }
+                    ctx.fill();
+                    if (cm.active>=0) {
+                        ctx.fillStyle = dotActiveFill;
+                        ctx.beginPath();
+                        ctx.arc(cm.items[cm.active].px, cm.items[cm.active].py, 8, 0, 2*Math.PI);
+                        ctx.fill();
+                    }
+                }
+            }
+//            return the index of the mark under the mouse, -1 otherwise
+            function canvasHit(mx,my) {
+                var cm = canvasMarks;
+                if (cm.type=='bar') {
+                    var bw = cm.xScale.bandwidth();
+                    for (var i=0;i<cm.items.length;i++) {
+                        var x = cm.xScale(cm.items[i].key);
+                        if (mx>=x && mx<=x+bw && my>=cm.yScale(cm.items[i].value) && my<=height) {return i;}
+                    }
+                }else if (cm.type=='dot') {
+                    var d = cm.tree.find(mx, my, 8);
+                    if (d) {return d.i;}
+                }
+                return -1;
+            }
+            function canvasMouseMove() {
+                var m = d3.mouse(this);
+                var hit = canvasHit(m[0], m[1]);
+                if (canvasMarks.type=='bar') {
+                    if (hit!=canvasMarks.active) {
+                        canvasMarks.active = hit;
+                        canvasDraw();
+                    }
+                    if (hit>=0) {showTooltip(canvasMarks.items[hit].label);}
+                    else {hideTooltip();}
+                }else if (canvasMarks.type=='dot' && canvasMarks.active>=0 && hit!=canvasMarks.active) {
+                    canvasMarks.active = -1;
+                    canvasDraw();
+                }
+                canvas.style("cursor", (hit>=0) ? "pointer" : null);
+            }
+            function canvasMouseOut() {
+                if (canvasMarks.active>=0) {
+                    canvasMarks.active = -1;
+                    canvasDraw();
+                }
+                hideTooltip();
+            }
+            function canvasClick() {
+                if (canvasMarks.type!='dot') {return;}
+                var m = d3.mouse(this);
+                var hit = canvasHit(m[0], m[1]);
+                if (hit>=0) {
+                    canvasMarks.active = hit;
+                    canvasDraw();
+                    runInfo(hit);
+                }
+            }
 //            
 //            Plot renderer
 //
-            function plotRender (svg,plotSelector,yLabel) {
+            function plotRender (plotSelector,yLabel) {
                 var textArea = document.getElementById('error1');
                 textArea.innerHTML="";
                 var xScale = d3.scaleBand().rangeRound([0, width]).padding(0.1);
                 var yScale = d3.scaleLinear().range([height, 0]);
                 var xAxis = d3.axisBottom().scale(xScale);
-                xScale.domain(runarr.map(function(d) {return d.date; }));                
                 var yAxis = d3.axisLeft().scale(yScale);        
-                if (plotSelector=='count') {
-                    yScale.domain([0, d3.max(runarr, function(d) {return d.ey.length; })]).nice();
-                }else if (plotSelector=='cd') {
-                    yScale.domain([0, d3.max(runarr, function(d) {return average(d.cd); })]).nice();
-                }else if (plotSelector=='cpf') {
-                    yScale.domain([0, d3.max(runarr, function(d) {return average(d.cpf); })]).nice();
-                }else if (plotSelector=='ey') {
-                    yScale.domain([0, d3.max(runarr, function(d) {return average(d.ey); })]).nice();
-                }
-//                Define the div for the tooltip
-                var div = d3.select("#plotElem").append("div")    
-                    .attr("class", "tooltip")                
-                    .style("opacity", 0);
-//                    X Axis
-                svg.append("g")
-                    .attr("class", "x axis")
-                    .attr("transform", "translate(0," + height + ")")
-                    .call(xAxis)
-                    .selectAll("text")
-                    .attr("y", 0)
-                    .attr("x", 9)
-                    .attr("dy", ".35em")
-                    .attr("transform", "rotate(90)")
-                    .style("text-anchor", "start");
-//                    Y Axis
-                svg.append("g")
-                    .attr("class", "y axis")
-                    .call(yAxis);
-//                Plot
-                svg.selectAll(".bar").data(runarr)
-                    .enter().append("rect")
-                    .attr("class", "bar")
-                    .attr("x", function(d) {return xScale(d.date); })
-                    .attr("width", xScale.bandwidth())
-                    .attr("y", function(d) {
-                        if (plotSelector=='count') {return yScale(d.ey.length);}
-                        else if (plotSelector=='cd') {return yScale(average(d.cd));}
-                        else if (plotSelector=='cpf') {return yScale(average(d.cpf));}
-                        else if (plotSelector=='ey') {return yScale(average(d.ey));}
-                    })
-                    .attr("height", function(d) {
-                        if (plotSelector=='count') {return height-yScale(d.ey.length);}
-                        else if (plotSelector=='cd') {return height-yScale(average(d.cd));}
-                        else if (plotSelector=='cpf') {return height-yScale(average(d.cpf));}
-                        else if (plotSelector=='ey') {return height-yScale(average(d.ey));}
-                    })
-                    .on('mouseover', function (d) {
-                        div.transition().duration(200).style("opacity", .9)
-                        var hval=0;
-                        if (plotSelector=='count') {hval = d.ey.length}
-                        else if (plotSelector=='cd') {hval = average(d.cd).toFixed(2)}
-                        else if (plotSelector=='cpf') {hval = average(d.cpf).toFixed(2)} 
-                        else if (plotSelector=='ey') {hval = average(d.ey).toFixed(2)}
-                        div.html(hval).style("left", (d3.event.pageX-28) + "px").style("top", (d3.event.pageY-28) + "px");
-                    })                    
-                    .on("mouseout", function(d) {
-                        div.transition().duration(500).style("opacity", 0);
-                        });
-//                Add Title
-             svg.append("text")
-                .attr("class","title")
-                .attr("x", titlePosX)
-                .attr("y", titlePosY)
-                .attr("text-anchor", "middle")
-                .text("Nextseq 500 run stats");
-//             X Label    
-            svg.append("text")
-                .attr("class","x label")
-                .attr("x", xlabX)
-                .attr("y", xlabY)
-                .attr("text-anchor", "middle")
-               .text('year-month');                
-//             Y Label
-                svg.append("text")
-                    .attr("class","y label")
-                    .attr("transform", "rotate(-90)")
-                    .attr("y", ylabY)
-                    .attr("x",ylabX)
-                    .style("text-anchor", "middle")
-                    .text(yLabel);                        
+                var bars = runarr.map(function(d) {
+                    var v = barValue(d,plotSelector);
+                    return {'key':d.date,'value':v,'label':(plotSelector=='count') ? v : v.toFixed(2)};
+                });
+                xScale.domain(bars.map(function(d) {return d.key; }));                
+                yScale.domain([0, d3.max(bars, function(d) {return d.value; })]).nice();
+                drawFrame(xAxis,yAxis,true,"Nextseq 500 run stats",'year-month',yLabel);
+                drawBars(bars,xScale,yScale,"bar");
             }
 //            Per month-year plot renderer
-            function plotYMRender(svg,ymdata,plotdata,plotyear,plotmonth,yLabel) {
-                var xvals  = [];
+            function plotYMRender(ymdata,plotdata,plotyear,plotmonth,yLabel) {
                 var xScale = d3.scaleBand().rangeRound([0, width]).padding(0.1);
                 var yScale = d3.scaleLinear().range([height, 0]);
-                for(var i=0;i<ymdata.run1.length;i++){
-                    xvals.push(i);
-                }
                 var yvals = [];
                 if (plotdata=='cd') {
                     yvals = ymdata.cd;
@@ -332,84 +582,29 @@ def plot_d3(all_runs):
                     yvals = ymdata.ey;
                     yScale.domain([0,eymax]).nice();
                 }
-                xScale.domain(xvals);
+                var bars = yvals.map(function(d,i) {return {'key':i,'value':d,'label':d.toFixed(2)}; });
+                xScale.domain(bars.map(function(d) {return d.key; }));
                 var xAxis = d3.axisBottom(xScale)
                     .tickFormat(function(d,i) {return ymdata.run1[i]; });            
                 var yAxis = d3.axisLeft().scale(yScale);    
-                            
-//                Define the div for the tooltip
-                var div = d3.select("#plotElem").append("div")    
-                    .attr("class", "tooltip")                
-                    .style("opacity", 0);
-//                    X Axis
-                svg.append("g")
-                    .attr("class", "x axis")
-                    .attr("transform", "translate(0," + height + ")")
-                    .call(xAxis)
-                    .selectAll("text")
-                    .attr("y", 0)
-                    .attr("x", 9)
-                    .attr("dy", ".35em")
-                    .attr("transform", "rotate(90)")
-                    .style("text-anchor", "start");
-//                    Y Axis
-                svg.append("g")
-                    .attr("class", "y axis")
-                    .call(yAxis);
-//                Plot
-                svg.selectAll(".bar").data(yvals)
-                    .enter().append("rect")
-                    .attr("class", "bar2")
-                    .attr("x", function (d,i) {return xScale(xvals[i])})
-                    .attr("width", xScale.bandwidth())
-                    .attr("y", function(d,i) {return yScale(d);})
-                    .attr("height", function(d,i) {return height-yScale(d);})
-                    .on('mouseover', function (d) {
-                        div.transition().duration(200).style("opacity", .9)
-                        div.html(d.toFixed(2)).style("left", (d3.event.pageX-28) + "px").style("top", (d3.event.pageY-28) + "px");
-                    })                    
-                    .on("mouseout", function(d) {
-                        div.transition().duration(500).style("opacity", 0);
-                        });
-//                Add Title
-             svg.append("text")
-                .attr("class","title")
-                .attr("x",titlePosX)
-                .attr("y",titlePosY)
-                .attr("text-anchor", "middle")
-                .text("Nextseq 500 run stats : 20"+plotyear+"."+plotmonth);
-//             X Label    
-            svg.append("text")
-                .attr("class","x label")
-                .attr("x", xlabX)
-                .attr("y", xlabY)
-                .attr("text-anchor", "middle")
-               .text("Read length/run");
-//             Y Label
-                svg.append("text")
-                    .attr("class","y label")
-                    .attr("transform", "rotate(-90)")
-                    .attr("y", ylabY)
-                    .attr("x", ylabX)
-                    .style("text-anchor", "middle")
-                    .text(yLabel);                                                        
+                drawFrame(xAxis,yAxis,true,"Nextseq 500 run stats : 20"+plotyear+"."+plotmonth,"Read length/run",yLabel);
+                drawBars(bars,xScale,yScale,"bar2");
             }
 //            
 //            scatter plotter
 //
-            function scatterPlotter(svg,onx,ony,xLabel,yLabel) {
-                var onxvar = [];
-                var onyvar = [];
-                for (var i=0;i<rundat.length;i++) {
-                    onxvar.push(rundat[i][onx]);
-                    onyvar.push(rundat[i][ony]);
-                }
-                var xlimit = d3.extent(onxvar);
-                var ylimit = d3.extent(onyvar);
+            function scatterPlotter(onx,ony,xLabel,yLabel) {
+                var dots = rundat.map(function(rn,i) {return {'i':i,'x':rn[onx],'y':rn[ony]}; });
+                var xlimit = d3.extent(dots, function(d) {return d.x; });
+                var ylimit = d3.extent(dots, function(d) {return d.y; });
                 var xScale = d3.scaleLinear().domain(xlimit).nice().range([0, width]);
                 var yScale = d3.scaleLinear().domain(ylimit).nice().range([height, 0]);
                 var xAxis = d3.axisBottom(xScale);
                 var yAxis = d3.axisLeft().scale(yScale);
+                for (var i=0;i<dots.length;i++) {
+                    dots[i].px = xScale(dots[i].x);
+                    dots[i].py = yScale(dots[i].y);
+                }
 //                push text element messge first
                 var textArea = document.getElementById('error1')
                 textArea.style.paddingTop="10px";
@@ -417,63 +612,52 @@ def plot_d3(all_runs):
                 textArea.style.fontWeight = "bold";
             textArea.style.color = "#000000";
             textArea.innerHTML="Click on a dot for details";
-                svg.append("g")
-                    .attr("class", "x axis")
-                    .attr("transform", "translate(0," + height + ")")
-                    .call(xAxis);
-                svg.append("g")
-                    .attr("class", "y axis")
-                .call(yAxis);
-                svg.selectAll(".dots").data(onxvar)
-                    .enter().append("circle")
+                drawFrame(xAxis,yAxis,false,"Nextseq 500 run stats",xLabel,yLabel);
+                gBars.selectAll("rect").remove();
+                if (renderMode=='canvas') {
+                    var tree = d3.quadtree()
+                        .x(function(d) {return d.px; })
+                        .y(function(d) {return d.py; })
+                        .addAll(dots);
+                    canvasMarks = {'type':'dot','items':dots,'xScale':xScale,'yScale':yScale,'fill':null,'tree':tree,'active':-1};
+                    canvasDraw();
+                    return;
+                }
+                var circles = gDots.selectAll("circle").data(dots, function(d) {return d.i; });
+                circles.exit().remove();
+                circles.enter().append("circle")
                     .attr("class","dots")
                     .attr("r",5)
-                    .attr("cx",function (d,i) {return xScale(onxvar[i]);})
-                    .attr("cy",function (d,i) {return yScale(onyvar[i]);})
-                    .style("fill","rgba(105, 50, 129,0.7)")
+                    .style("fill",dotFill)
                     .on("click",clickEvent)
-                    .on("mouseout",mouseOutEvent);
-//                Add Title
-             svg.append("text")
-                .attr("class","title")
-                .attr("x", titlePosX)
-                .attr("y", titlePosY)
-                .attr("text-anchor", "middle")
-                .text("Nextseq 500 run stats");
-//             X Label    
-            svg.append("text")
-                .attr("class","x label")
-                .attr("x", xlabX)
-                .attr("y", xlabY)
-                .attr("text-anchor", "middle")
-               .text(xLabel);
-//             Y Label
-                svg.append("text")
-                    .attr("class","y label")
-                    .attr("transform", "rotate(-90)")
-                    .attr("y", ylabY)
-                    .attr("x", ylabX)
-                    .style("text-anchor", "middle")
-                    .text(yLabel);                
+                    .on("mouseout",mouseOutEvent)
+                  .merge(circles)
+                    .attr("cx",function (d) {return d.px;})
+                    .attr("cy",function (d) {return d.py;});
 //                handle click event
-                function clickEvent(d,i) {
+                function clickEvent(d) {
                     d3.select(this).transition()
-                            .style("fill","#5b2c6f")
+                            .style("fill",dotActiveFill)
                             .attr("r", 8);
-//                    textArea.style.fontWeight = "";
-                    var dotInfo =rundat[i][8]+"<table id=infoTable><tr><td class=\\"description1\\">Run date</td><td>"+rundat[i][0]+"</td></tr>";
-                    dotInfo+="<tr><td class=\\"description1\\">Read1</td><td>"+rundat[i][3]+"</td></tr><tr><td class=\\"description1\\">Read2</td><td>"+rundat[i][4]+"</td></tr>";
-                    dotInfo+="<tr><td class=\\"description1\\">BaseSpaceRunId</td><td>"+rundat[i][7]+"</td>";
-                    dotInfo+="<tr><td class=\\"description1\\">LibraryID</td><td>"+rundat[i][9]+"</td>";
-                    textArea.innerHTML=dotInfo;
+                    runInfo(d.i);
                 }
 //                handle mouse out event
-                function mouseOutEvent(d,i) {
+                function mouseOutEvent(d) {
                     d3.select(this).transition()
-                            .style("fill","rgba(105, 50, 129,0.7)")
+                            .style("fill",dotFill)
                             .attr("r", 5);
                 }
             }
+//            run details for a scatter plot dot
+            function runInfo(i) {
+                var textArea = document.getElementById('error1');
+//                    textArea.style.fontWeight = "";
+                var dotInfo =rundat[i][8]+"<table id=infoTable><tr><td class=\\"description1\\">Run date</td><td>"+rundat[i][0]+"</td></tr>";
+                dotInfo+="<tr><td class=\\"description1\\">Read1</td><td>"+rundat[i][3]+"</td></tr><tr><td class=\\"description1\\">Read2</td><td>"+rundat[i][4]+"</td></tr>";
+                dotInfo+="<tr><td class=\\"description1\\">BaseSpaceRunId</td><td>"+rundat[i][7]+"</td>";
+                dotInfo+="<tr><td class=\\"description1\\">LibraryID</td><td>"+rundat[i][9]+"</td>";
+                textArea.innerHTML=dotInfo;
+            }
             
 //        
 //            data init and manipulation
@@ -500,6 +684,18 @@ def plot_d3(all_runs):
                 if(rn[11]>cpfmax){cpfmax = rn[11];}
                 if(rn[12]>eymax){eymax = rn[12];}
             }
+//            usage per month, summed over instruments
+            var usagemap = {};
+            for (let us of usagedat) {
+                us1 = us[0].substr(2,2)+us[0].substr(5,2);
+                if (!(us1 in usagemap)) {
+                    usagemap[us1] = {'uyield':0,'ucycles':0,'uhours':0,'uidle':0};
+                }
+                usagemap[us1].uyield+=us[3];
+                usagemap[us1].ucycles+=us[4];
+                usagemap[us1].uhours+=us[5];
+                usagemap[us1].uidle+=us[6];
+            }
             var runarr = [];
             for (var key in runmap) {
                 runarr.push(runmap[key]);
@@ -524,6 +720,57 @@ def plot_d3(all_runs):
             var xlabY = height+(margin.bottom*0.8);
             var ylabX = 0 - (height / 2);
             var ylabY = 0 - (margin.left*0.6);
+//            axes, marks and labels, updated in place by the renderers
+            var gX = svg.append("g")
+                .attr("class", "x axis")
+                .attr("transform", "translate(0," + height + ")");
+            var gY = svg.append("g")
+                .attr("class", "y axis");
+            var gBars = svg.append("g");
+            var gDots = svg.append("g");
+            var titleText = svg.append("text")
+                .attr("class","title")
+                .attr("x", titlePosX)
+                .attr("y", titlePosY)
+                .attr("text-anchor", "middle");
+            var xLabelText = svg.append("text")
+                .attr("class","x label")
+                .attr("x", xlabX)
+                .attr("y", xlabY)
+                .attr("text-anchor", "middle");
+            var yLabelText = svg.append("text")
+                .attr("class","y label")
+                .attr("transform", "rotate(-90)")
+                .attr("y", ylabY)
+                .attr("x", ylabX)
+                .style("text-anchor", "middle");
+//            Define the div for the tooltip
+            var tooltip = d3.select("body").append("div")
+                .attr("class", "tooltip")
+                .style("opacity", 0);
+//            mark colors, canvas mode can't use the css classes
+            var barFill = {'bar':['#0288d1','#4fc3f7'],'bar2':['#388e3c','#81c784']};
+            var dotFill = "rgba(105, 50, 129,0.7)";
+            var dotActiveFill = "#5b2c6f";
+//            canvas on top of the plot area, only for large data sets
+            var canvas = null, ctx = null;
+            var canvasMarks = {'type':null,'items':[],'xScale':null,'yScale':null,'fill':null,'tree':null,'active':-1};
+            if (renderMode=='canvas') {
+                var ratio = window.devicePixelRatio || 1;
+                canvas = d3.select("#plotElem").append("canvas")
+                    .attr("width", width*ratio)
+                    .attr("height", height*ratio)
+                    .style("width", width + "px")
+                    .style("height", height + "px")
+                    .style("position", "absolute")
+                    .style("left", margin.left + "px")
+                    .style("top", margin.top + "px")
+                    .on("mousemove", canvasMouseMove)
+                    .on("mouseout", canvasMouseOut)
+                    .on("click", canvasClick);
+                ctx = canvas.node().getContext("2d");
+                ctx.scale(ratio, ratio);
+            }
 //
 //            activate and deactivate options
 // 
@@ -618,7 +865,7 @@ def plot_d3(all_runs):
 //            call the  first bar plot on init
 //            init y label
             var yLabel = 'Runs per month';
-            plotRender(svg,plotSelector,yLabel);
+            plotRender(plotSelector,yLabel);
 //
 //            meta plot renderer
 //
@@ -626,8 +873,7 @@ def plot_d3(all_runs):
                 var plotvar =  document.getElementById("inputf1");
                 var plotSelector = plotvar.options[document.getElementById("inputf1").selectedIndex].value;
                 yLabel = plotvar.options[document.getElementById("inputf1").selectedIndex].textContent;
-                svg.selectAll("g > *").remove();
-                plotRender(svg,plotSelector,yLabel);
+                plotRender(plotSelector,yLabel);
             }
 //
 //            plot per month data
@@ -646,10 +892,7 @@ def plot_d3(all_runs):
             textArea.style.paddingTop="10px";
                 if (plotym in runmap) {
                     textArea.innerHTML="";
-                    svg.selectAll("g > *").remove();
-                    var ymdat = [];
-                    ymdat.push(runmap[plotym])
-                    plotYMRender(svg,runmap[plotym],plotdata,plotyear,plotmonth,yLabel);
+                    plotYMRender(runmap[plotym],plotdata,plotyear,plotmonth,yLabel);
                 }else {
                     textArea.style.fontSize = "16px";
                     textArea.style.fontWeight = "bold";
@@ -667,80 +910,301 @@ def plot_d3(all_runs):
                 var yy = document.getElementById("inputf8");
                 var yyvar = xx.options[document.getElementById("inputf8").selectedIndex].value;
                 var yLabel = xx.options[document.getElementById("inputf8").selectedIndex].textContent;
-                svg.selectAll("g > *").remove();
-                scatterPlotter(svg,xxvar,yyvar,xLabel,yLabel);
+                scatterPlotter(xxvar,yyvar,xLabel,yLabel);
             }
         </script>
     </body>
 </html>
     ''')
-    return html_template.render(all_dat_json=json.dumps(all_runs))
+    return html_template.render(run_pack_json=json.dumps(pack_runs(all_runs),separators=(',',':')),render_mode=render_mode,d3_inline=d3_inline,usage_json=json.dumps(usage))
     
 
-def parse_run_stats(foldername):
+def open_checkpoint(checkpoint,foldername,resume=False):
+    '''
+    Open a checkpoint file for appending parsed runs, one json line per run folder.
+    With resume, also return the runs already parsed in it as a dict: run folder -> run data.
+    The checkpoint must have the same base folder and columns (run_header) as the current scan
+    '''
+    scanned = dict()
+    if resume and os.path.exists(checkpoint):
+        with open(checkpoint) as ckh:
+            for ln,line in enumerate(ckh):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning('Skipping incomplete line {} in checkpoint: {}'.format(ln+1,checkpoint))
+                    continue
+                if 'base' in entry:
+                    if entry['base']!=foldername:
+                        raise RuntimeError('Checkpoint {} is for base folder {}, not {}'.format(checkpoint,entry['base'],foldername))
+                    if entry.get('columns')!=run_header:
+                        raise RuntimeError('Checkpoint {} has different columns than the current scan, start a new checkpoint without --resume'.format(checkpoint))
+                elif len(entry['run'])!=len(run_header):
+                    logger.warning('Re-parsing {}, wrong number of columns in checkpoint: {}'.format(entry['folder'],checkpoint))
+                else:
+                    scanned[entry['folder']] = entry['run']
+        logging.info('Resuming from checkpoint: {}, runs: {}'.format(checkpoint,len(scanned)))
+        ckh = open(checkpoint,'a')
+        # an interrupted write can leave a partial last line, start a fresh one
+        if ckh.tell()>0:
+            with open(checkpoint,'rb') as lh:
+                lh.seek(-1,os.SEEK_END)
+                if lh.read(1)!=b'\n':
+                    ckh.write('\n')
+    else:
+        if os.path.exists(checkpoint):
+            logging.warning('Over-writing file: {}'.format(checkpoint))
+        ckh = open(checkpoint,'w')
+        ckh.write(json.dumps({'base':foldername,'columns':run_header})+'\n')
+    return ckh, scanned
+
+def flush_checkpoint(ckh):
+    '''
+    Push checkpointed runs to disk
+    '''
+    ckh.flush()
+    os.fsync(ckh.fileno())
+
+def ascii_text(text):
+    return text.encode('ascii', 'ignore').decode('ascii')
+
+def runid_date(text):
+    '''
+    Run date as YYMMDD from the date prefix of a run id (YYMMDD_ or YYYYMMDD_)
+    '''
+    return text.split('_')[0][-6:]
+
+field_files = ['RunParameters.xml','RunCompletionStatus.xml']
+field_conversions = {'s':ascii_text,'i':int,'f':float,'runid_date':runid_date}
+field_defaults = {'s':None,'i':0,'f':0.0}
+
+# compiled extraction plans per variant, see variant_plan
+run_plans = dict()
+
+def load_fields(config):
+    '''
+    Add columns and schema variants from a json config file, example:
+    {"columns": {"FlowCell": "s"},
+     "variants": {"nextseq500": {"fields": {"FlowCell": ["RunParameters.xml", "FlowCellSerial"]}},
+                  "myseq": {"detect": "MySetup", "fields": {...}}}}
+    New columns are added after the existing ones, new variants are detected after the existing ones
+    and start with the RunCompletionStatus.xml fields (completion_fields)
+    '''
+    with open(config) as ch:
+        fconf = json.load(ch)
+    for col,ctype in fconf.get('columns',dict()).items():
+        if ctype not in field_defaults:
+            raise RuntimeError('Unknown type {} for column {} in {}, allowed types: {}'.format(ctype,col,config,', '.join(field_defaults)))
+        if col not in run_header:
+            run_header.append(col)
+            run_coltypes.append(ctype)
+    for variant,vconf in fconf.get('variants',dict()).items():
+        if variant not in run_variants:
+            if 'detect' not in vconf:
+                raise RuntimeError('New variant {} in {} needs a detect path'.format(variant,config))
+            run_variants[variant] = {'detect':vconf['detect'],'fields':dict(completion_fields)}
+        elif 'detect' in vconf:
+            run_variants[variant]['detect'] = vconf['detect']
+        for col,spec in vconf.get('fields',dict()).items():
+            if col not in run_header:
+                raise RuntimeError('Unknown column {} for variant {} in {}'.format(col,variant,config))
+            if not isinstance(spec,list) or not 2<=len(spec)<=4:
+                raise RuntimeError('Column {} for variant {} in {} must be a list: [xml file, path, attribute, conversion], attribute and conversion are optional'.format(col,variant,config))
+            if spec[0] not in field_files:
+                raise RuntimeError('Unknown xml file {} for column {} in {}, allowed files: {}'.format(spec[0],col,config,', '.join(field_files)))
+            if len(spec)==4 and spec[3] is not None and spec[3] not in field_conversions:
+                raise RuntimeError('Unknown conversion {} for column {} in {}, allowed conversions: {}'.format(spec[3],col,config,', '.join(field_conversions)))
+            run_variants[variant]['fields'][col] = tuple(spec)
+    run_plans.clear()
+    logging.info('Run fields config: {}'.format(config))
+
+def variant_plan(variant):
+    '''
+    Return the extraction plan for a schema variant, compiled once:
+    one (xml file, path, attribute, conversion, default) entry per column
+    '''
+    if variant not in run_plans:
+        fields = run_variants[variant]['fields']
+        plan = list()
+        for col,ctype in zip(run_header,run_coltypes):
+            spec = fields.get(col)
+            if spec is None:
+                plan.append((None,None,None,None,field_defaults[ctype]))
+                continue
+            xmlf, path, attr, conv = (tuple(spec)+(None,None,None))[:4]
+            plan.append((xmlf,path,attr,field_conversions[conv or ctype],field_defaults[ctype]))
+        run_plans[variant] = plan
+    return run_plans[variant]
+
+def detect_variant(rpet):
+    '''
+    Return the schema variant of a parsed RunParameters.xml, None if no variant matches
+    '''
+    for variant,vdat in run_variants.items():
+        if rpet.find(vdat['detect']) is not None:
+            return variant
+    return None
+
+def extract_run(plan,xmltrees,xmlfiles):
+    '''
+    Return run data for the parsed xml files (file name -> tree, file name -> path) following an extraction plan
+    '''
+    run_data = list()
+    for xmlf,path,attr,conv,default in plan:
+        if xmlf is None:
+            run_data.append(default)
+        elif path is None:
+            run_data.append(datetime.datetime.fromtimestamp(os.path.getmtime(xmlfiles[xmlf])).strftime(time_format))
+        else:
+            elem = xmltrees[xmlf].find(path)
+            if elem is None:
+                text = None
+            elif attr is None:
+                text = elem.text
+            else:
+                text = elem.get(attr)
+            run_data.append(default if text is None else conv(text))
+    return run_data
+
+def parse_run_stats(foldername,checkpoint=None,resume=False,checkpoint_every=100):
     '''
     Look for illumina run folders in the given parent folder (file name starts with ^\d+\_)
     and if these folders have files named RunParameters.xml and RunCompletionStatus.xml parse'em for info
+    checkpoint: file to save parsed runs to as the scan goes, flushed every checkpoint_every runs
+    resume: re-use the runs in checkpoint and only parse the remaining run folders
     '''
     foldername = os.path.abspath(foldername)
     if not os.path.isdir(foldername):
         raise RuntimeError('{} is not a folder!'.format(foldername))
     all_runs = list()
     runs = 0
-    for subd in os.listdir(foldername):
-        subdf = os.path.join(foldername,subd)
-        rp = os.path.join(subdf,'RunParameters.xml')
-        rcs = os.path.join(subdf,'RunCompletionStatus.xml')
-        if re.match('^\d+\_.*$', subd, re.IGNORECASE):
-            if os.path.isdir(subdf) and os.path.exists(rcs) and os.path.exists(rp):
-                logging.debug('Run folder : {}'.format(subd))
-                run_data = list()
-                rpet = ET.parse(rp)
-                run_data.append(rpet.find(runparam_xpath['rundate']).text) # date
-                run_data.append(rpet.find(runparam_xpath['runid']).text) # run id
-                run_data.append(int(rpet.find(runparam_xpath['runnumber']).text)) # run number as int
-                run_data.append(int(rpet.find(runparam_xpath['read1']).text)) # read1 as int
-                run_data.append(int(rpet.find(runparam_xpath['read2']).text)) # read2 as int
-                run_data.append(int(rpet.find(runparam_xpath['index1']).text)) # index1 as int
-                run_data.append(int(rpet.find(runparam_xpath['index2']).text)) # index2 as int
-                run_data.append(rpet.find(runparam_xpath['basespaceid']).text) # basespacerunid
-                run_data.append(rpet.find(runparam_xpath['experiment']).text.encode('ascii', 'ignore')) # Experiment name
-                run_data.append(rpet.find(runparam_xpath['libid']).text.encode('ascii', 'ignore')) # Library id
-                rcset = ET.parse(rcs)
-                run_data.append(float(rcset.find(runcompletion_xpath['cd']).text)) # Cluster density
-                run_data.append(float(rcset.find(runcompletion_xpath['cpf']).text)) # Cluster passing filter
-                run_data.append(float(rcset.find(runcompletion_xpath['ey']).text)) # Estimated yield
-                run_data.append(rcset.find(runcompletion_xpath['status']).text) # status
-                all_runs.append(run_data)
-                runs+=1
+    scanned = dict()
+    ckh = None
+    if checkpoint is not None:
+        ckh, scanned = open_checkpoint(checkpoint,foldername,resume)
+    try:
+        for subd in os.listdir(foldername):
+            if subd in scanned:
+                all_runs.append(scanned[subd])
+                continue
+            subdf = os.path.join(foldername,subd)
+            rp = os.path.join(subdf,'RunParameters.xml')
+            rcs = os.path.join(subdf,'RunCompletionStatus.xml')
+            if re.match('^\d+\_.*$', subd, re.IGNORECASE):
+                if os.path.isdir(subdf) and os.path.exists(rcs) and os.path.exists(rp):
+                    rpet = ET.parse(rp)
+                    variant = detect_variant(rpet)
+                    if variant is None:
+                        logger.warning('Unknown RunParameters.xml layout in {}'.format(subd))
+                        continue
+                    logging.debug('Run folder : {}, layout: {}'.format(subd,variant))
+                    xmlfiles = dict(zip(field_files,[rp,rcs]))
+                    xmltrees = dict(zip(field_files,[rpet,ET.parse(rcs)]))
+                    run_data = extract_run(variant_plan(variant),xmltrees,xmlfiles)
+                    missing = [col for col in required_columns if run_data[run_header.index(col)] is None]
+                    if missing:
+                        logger.warning('Skipping {}, no {} found'.format(subd,', '.join(missing)))
+                        continue
+                    all_runs.append(run_data)
+                    runs+=1
+                    if ckh is not None:
+                        ckh.write(json.dumps({'folder':subd,'run':run_data})+'\n')
+                        if runs%checkpoint_every==0:
+                            flush_checkpoint(ckh)
+                            logging.info('Runs parsed: {}, checkpoint: {}'.format(runs,checkpoint))
+                else:
+                    logger.warning('Cannot access {}'.format(subd)) 
             else:
-                logger.warning('Cannot access {}'.format(subd)) 
-        else:
-            logger.warning('Does not look like an Illumina run folder {}'.format(subd))
+                logger.warning('Does not look like an Illumina run folder {}'.format(subd))
+    finally:
+        if ckh is not None:
+            flush_checkpoint(ckh)
+            ckh.close()
     logging.info('Runs parsed: {}'.format(runs))
+    if len(all_runs)>runs:
+        logging.info('Runs from checkpoint: {}'.format(len(all_runs)-runs))
     return sorted(all_runs,key=itemgetter(0))
 
 def to_csv(all_runs,outname):
-    header = ["Date","RunID","RunNumber","Read1","Read2","Index1Read","Index2Read","BaseSpaceRunId","ExperimentName",
-              "LibraryID","ClusterDensity","ClustersPassingFilter","EstimatedYield","CompletionStatus"]
     if os.path.exists(outname):
         logging.warning('Over-writing file: {}'.format(outname))
     with open(outname,'w') as oh:
-        oh.write("\t".join(header)+"\n")
+        oh.write("\t".join(run_header)+"\n")
         for rdat in all_runs:
             oh.write("\t".join(map(lambda rd: str(rd), rdat))+"\n")
     logging.info('TSV data file: {}'.format(outname))
 
-def to_html(all_runs,htmlname):
+def run_usage(all_runs):
+    '''
+    Instrument usage per month and instrument, in a single pass over the runs sorted by start and completion time:
+    runs, total estimated yield, cycles (Read1+Read2+Index1Read+Index2Read), instrument hours (run start to completion)
+    and idle hours (previous completion to run start on the same instrument).
+    Completion times are RunCompletionStatus.xml modification times, runs ending before their start date or
+    taking more than max_run_hours (e.g. archives copied without timestamps) are left out of the instrument hours,
+    and idle hours stop at their start. Runs with a date that is not YYMMDD are counted under month NA, without hours.
+    Run start dates have day resolution, so instrument hours are over- and idle hours under-estimated by up to a day
+    '''
+    usage = dict()
+    last_end = dict()
+    for rdat in sorted(all_runs,key=itemgetter(0,14)):
+        try:
+            start = datetime.datetime.strptime(rdat[0],rundate_format)
+            end = datetime.datetime.strptime(rdat[14],time_format)
+        except ValueError:
+            start = end = None
+        instrument = rdat[1].split('_')[1] if rdat[1].count('_')>1 else 'NA'
+        ukey = (start.strftime('%Y-%m') if start is not None else 'NA',instrument)
+        if ukey not in usage:
+            usage[ukey] = [0,0.0,0,0.0,0.0]
+        udat = usage[ukey]
+        udat[0]+=1
+        udat[1]+=rdat[12]
+        udat[2]+=rdat[3]+rdat[4]+rdat[5]+rdat[6]
+        if start is None:
+            logger.warning('Run {} has date {} and completion time {}, not used for instrument and idle hours'.format(rdat[1],rdat[0],rdat[14]))
+            continue
+        if instrument in last_end and start>last_end[instrument]:
+            udat[4]+=(start-last_end[instrument]).total_seconds()/3600.0
+        run_hours = (end-start).total_seconds()/3600.0
+        if run_hours<0 or run_hours>max_run_hours:
+            logger.warning('Run {} takes {:.2f} hours, not used for instrument hours'.format(rdat[1],run_hours))
+            # the instrument is busy from this run's start to an unknown end, no idle hours until the next run
+            last_end.pop(instrument,None)
+            continue
+        udat[3]+=run_hours
+        if instrument not in last_end or end>last_end[instrument]:
+            last_end[instrument] = end
+    return [list(ukey)+[udat[0],round(udat[1],2),udat[2],round(udat[3],2),round(udat[4],2)] for ukey,udat in sorted(usage.items())]
+
+def usage_to_csv(usage,outname):
+    if os.path.exists(outname):
+        logging.warning('Over-writing file: {}'.format(outname))
+    with open(outname,'w') as oh:
+        oh.write("\t".join(usage_header)+"\n")
+        for udat in usage:
+            oh.write("\t".join(map(lambda ud: str(ud), udat))+"\n")
+    logging.info('TSV usage file: {}'.format(outname))
+
+def usage_to_json(usage,outname):
+    if os.path.exists(outname):
+        logging.warning('Over-writing file: {}'.format(outname))
+    with open(outname,'w') as oh:
+        json.dump([dict(zip(usage_header,udat)) for udat in usage],oh,indent=1)
+    logging.info('JSON usage file: {}'.format(outname))
+
+def to_html(all_runs,htmlname,render_mode='auto',d3js=None,usage=None):
+    # render first, so that a failure does not truncate an existing report
+    html = plot_d3(all_runs,render_mode,d3js,usage)
     if os.path.exists(htmlname):
         logging.warning('Over-writing file: {}'.format(htmlname))
-    with open(htmlname,'w') as htmlh:
-        htmlh.write(plot_d3(all_runs))
+    with io.open(htmlname,'w',encoding='utf-8') as htmlh:
+        htmlh.write(html)
     logging.info('Html plot file: {}'.format(htmlname))
 
 def main(argv):
     prog = re.sub('^.*\/','',argv[0])
     loglevels = ['debug','info','warning','error','quiet']
+    rendermodes = ['auto','svg','canvas']
     description = ''' Generate Nextseq run statistics data.
     NOTE: This script looks for RunParameters.xml and RunCompletionStatus.xml files in all subdirectories of the input folder 
     '''
@@ -749,9 +1213,21 @@ def main(argv):
     ncargs.add_argument('--base',metavar='Folder',dest='basefolder',help='Base folder with Illumina runs in subdirectories (example: /illumina/)',required=True)
     ncargs.add_argument('--tsv',metavar='TSV out',dest='tsv',help='Output file name for TSV formatted data, (default: nextseq_run_info.txt)',default='nextseq_run_info.txt', type=str)
     ncargs.add_argument('--html',metavar='HTML out',dest='html',help='Output file name for HTML plots, (default: nextseq_run_info.html)',default='nextseq_run_info.html', type=str)
+    ncargs.add_argument('--usage-tsv',metavar='TSV out',dest='usage_tsv',help='Output file name for TSV formatted instrument usage per month,\ninstrument and idle hours use RunCompletionStatus.xml modification times (default: nextseq_run_usage.txt)',default='nextseq_run_usage.txt', type=str)
+    ncargs.add_argument('--usage-json',metavar='JSON out',dest='usage_json',help='Output file name for JSON formatted instrument usage per month,\ninstrument and idle hours use RunCompletionStatus.xml modification times (default: nextseq_run_usage.json)',default='nextseq_run_usage.json', type=str)
+    ncargs.add_argument('--fields',metavar='Fields config',dest='fields',help='JSON file with additional columns and RunParameters.xml layouts to extract, see load_fields (default: none)',default=None, type=str)
+    ncargs.add_argument('--checkpoint',metavar='Checkpoint file',dest='checkpoint',help='Save parsed runs to this file during the scan, for use with --resume (default: no checkpoint)',default=None, type=str)
+    ncargs.add_argument('--resume',dest='resume',help='Continue an interrupted scan from the runs saved in --checkpoint',action='store_true',default=False)
+    ncargs.add_argument('--render',metavar='Render mode',dest='render',help='Html plot rendering, allowed choices: '+', '.join(rendermodes)+' (default: auto, canvas for more than {} runs)'.format(canvas_threshold),choices=rendermodes,default='auto')
+    ncargs.add_argument('--offline',metavar='d3 bundle',dest='offline',help='Inline a local d3 v4 bundle in the HTML file, for viewing without internet access\n(default: {})'.format(d3_bundle),nargs='?',const=d3_bundle,default=None)
     ncargs.add_argument('--verbose',metavar='Verbose level',dest='log',help='Allowed choices: '+', '.join(loglevels)+' (default: info)',choices=loglevels,default='info')
+    ncopts = dict()
     try:
         ncopts = vars(ncargs.parse_args())
+        if ncopts['resume'] and ncopts['checkpoint'] is None:
+            ncargs.error('--resume requires --checkpoint')
+        if ncopts['offline'] is not None and not os.path.isfile(ncopts['offline']):
+            ncargs.error('Cannot find d3 bundle {} for --offline, download it from https://d3js.org/d3.v4.min.js'.format(ncopts['offline']))
         if ncopts['log']== 'quiet':
             logger.addHandler(logging.NullHandler())
         else:
@@ -760,10 +1236,17 @@ def main(argv):
             consHandle.setLevel(logging.getLevelName(ncopts['log'].upper()))
             consHandle.setFormatter(logging.Formatter(' [%(levelname)s]  %(message)s'))
             logger.addHandler(consHandle)
-        all_run_dat = parse_run_stats(ncopts['basefolder'])
+        if ncopts['fields'] is not None:
+            load_fields(ncopts['fields'])
+        all_run_dat = parse_run_stats(ncopts['basefolder'], ncopts['checkpoint'], ncopts['resume'])
         to_csv(all_run_dat, ncopts['tsv'])
-        to_html(all_run_dat, ncopts['html'])
+        usage_dat = run_usage(all_run_dat)
+        usage_to_csv(usage_dat, ncopts['usage_tsv'])
+        usage_to_json(usage_dat, ncopts['usage_json'])
+        to_html(all_run_dat, ncopts['html'], ncopts['render'], ncopts['offline'], usage_dat)
     except KeyboardInterrupt:
+        if ncopts.get('checkpoint') is not None:
+            sys.stderr.write('Parsed runs saved to {}, use --resume to continue\n'.format(ncopts['checkpoint']))
         sys.stderr.write('Keyboard interrupt...Goodbye\n')
     except Exception:
         traceback.print_exc(file=sys.stdout)